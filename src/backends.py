@@ -0,0 +1,139 @@
+'''
+# Inference Backends
+
+Backends the extraction scripts use to turn a batch of page images into
+markdown. OllamaBackend talks to a local Ollama server; VLLMBackend talks to
+any OpenAI-compatible endpoint, most usefully vLLM, whose continuous batching
+and paged KV cache scale much better when many independent page requests are
+in flight (see the README for the vLLM launch command).
+
+## Author Information
+- **Author**: Nic Cravino
+- **Email**: spidernic@me.com
+- **LinkedIn**: [Nic Cravino](https://www.linkedin.com/in/nic-cravino)
+
+## License: Apache License 2.0 (Open Source)
+For full details, see the [Apache License 2.0](https://www.apache.org/licenses/LICENSE-2.0).
+'''
+
+import base64
+import os
+
+import httpx
+import ollama
+
+# Ollama server endpoint; point this at a remote host to offload inference.
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+
+# OpenAI-compatible endpoint for the vllm backend, e.g. a local `vllm serve`.
+VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://localhost:8000/v1")
+
+# Failures worth retrying, shared by the scripts' retry decorators and their
+# last-resort except clauses. httpx.HTTPError covers dropped connections and
+# timeouts; ollama.ResponseError is how the ollama client surfaces HTTP-status
+# failures such as a transient 500/503 (it is not an httpx.HTTPError);
+# KeyError is a streamed chunk arriving without its message body. The openai
+# errors join the tuple only when the package is installed, mirroring the
+# lazy import in VLLMBackend.
+RETRYABLE_ERRORS = (httpx.HTTPError, ollama.ResponseError, KeyError)
+try:
+    import openai
+    RETRYABLE_ERRORS += (openai.OpenAIError,)
+except ImportError:
+    pass
+
+class Backend:
+    """
+    One model call: send a prompt plus encoded page images, return markdown.
+    images_data entries may be raw bytes or pre-encoded base64 strings.
+    Implementations hold a single async client so every request in a run
+    shares one connection pool.
+    """
+
+    async def chat(self, model: str, prompt: str, images_data: list) -> str:
+        raise NotImplementedError
+
+class OllamaBackend(Backend):
+    """
+    Backend for a local Ollama server. keep_alive=-1 pins the model in VRAM
+    between requests and num_ctx bounds KV-cache allocation.
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST):
+        # One client for the whole run: every request shares its connection
+        # pool, so keep-alive connections survive between batches instead of
+        # paying a TCP handshake per call. The generous timeout covers cold
+        # model loads and long multi-image generations.
+        self.client = ollama.AsyncClient(host=host, timeout=600)
+
+    async def chat(self, model: str, prompt: str, images_data: list) -> str:
+        # Streaming keeps the server pushing tokens as they are generated
+        # instead of buffering the whole completion, so a stalled request
+        # fails fast inside the retry window. Chunks are joined per request;
+        # concurrent batches cannot write straight to the output file without
+        # interleaving pages.
+        stream = await self.client.chat(
+            model=model,
+            messages=[{
+                'role': 'user',
+                'content': prompt,
+                'images': images_data
+            }],
+            keep_alive=-1,
+            options={'num_ctx': 4096},
+            stream=True
+        )
+        parts = []
+        async for chunk in stream:
+            parts.append(chunk['message']['content'])
+        return ''.join(parts)
+
+def _image_mime_type(image_data) -> str:
+    """
+    Mime type for one page image, sniffed from its magic number. Accepts raw
+    bytes or a base64 string (the first 8 base64 characters decode to the
+    first 6 bytes, which is enough to recognize the PNG signature). The
+    scripts only produce JPEG and PNG, so anything that isn't PNG is JPEG.
+    """
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data[:8])
+    return "image/png" if image_data.startswith(b"\x89PNG") else "image/jpeg"
+
+class VLLMBackend(Backend):
+    """
+    Backend for an OpenAI-compatible server such as vLLM. Images travel as
+    base64 data URLs in the standard chat.completions multimodal format. The
+    openai package is imported lazily so Ollama-only installs don't need it.
+    """
+
+    def __init__(self, base_url: str = VLLM_BASE_URL):
+        from openai import AsyncOpenAI
+        self.client = AsyncOpenAI(base_url=base_url, api_key=os.getenv("OPENAI_API_KEY", "EMPTY"))
+
+    async def chat(self, model: str, prompt: str, images_data: list) -> str:
+        content = [
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:{_image_mime_type(image_data)};base64," + (
+                    image_data if isinstance(image_data, str)
+                    else base64.b64encode(image_data).decode()
+                )}
+            }
+            for image_data in images_data
+        ]
+        content.append({"type": "text", "text": prompt})
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": content}]
+        )
+        return response.choices[0].message.content
+
+def create_backend(name: str) -> Backend:
+    """
+    Build the backend named "ollama" or "vllm".
+    """
+    if name == "ollama":
+        return OllamaBackend()
+    if name == "vllm":
+        return VLLMBackend()
+    raise ValueError(f"Unknown backend: {name}")
@@ -0,0 +1,74 @@
+'''
+# Page Cache
+
+Content-addressable cache of per-page markdown, keyed by model name plus the
+SHA-256 of the page's image bytes, backed by a single sqlite database in WAL
+mode. Re-running the tool on input it has already seen turns inference into a
+database read, which makes long runs crash-resilient: whatever finished
+before an interruption is never recomputed.
+
+## Author Information
+- **Author**: Nic Cravino
+- **Email**: spidernic@me.com
+- **LinkedIn**: [Nic Cravino](https://www.linkedin.com/in/nic-cravino)
+
+## License: Apache License 2.0 (Open Source)
+For full details, see the [Apache License 2.0](https://www.apache.org/licenses/LICENSE-2.0).
+'''
+
+import hashlib
+import os
+import sqlite3
+
+# Directory holding the cache database; shared by both scripts.
+CACHE_DIR = os.getenv("PDF2MD_CACHE_DIR", "./.cache/pdf2md")
+
+class Cache:
+    """
+    sqlite-backed markdown cache. One row per (model, image hash); WAL mode
+    keeps reads from blocking the writes that follow each model response.
+    A single database replaces the one-file-per-page layout, whose open/
+    read/close per lookup dominated cache cost on large corpora.
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = os.path.join(CACHE_DIR, "cache.sqlite")
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " model TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+
+    @staticmethod
+    def key(image_data: bytes) -> str:
+        """
+        Cache key for one page image: the SHA-256 of its encoded bytes.
+        """
+        return hashlib.sha256(image_data).hexdigest()
+
+    def get(self, model: str, key: str):
+        """
+        Return the cached markdown for a key under a model, or None on a miss.
+        """
+        row = self.conn.execute(
+            "SELECT content FROM pages WHERE model = ? AND key = ?", (model, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model: str, key: str, content: str):
+        """
+        Store the markdown produced for a key under a model.
+        """
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pages (model, key, content) VALUES (?, ?, ?)",
+            (model, key, content)
+        )
+        self.conn.commit()
@@ -24,79 +24,184 @@ This script is licensed under the Apache License, Version 2.0. You are free to u
 - **Liability Disclaimer**: The software is provided "as is," without warranties or conditions of any kind.
 For full details, see the [Apache License 2.0](https://www.apache.org/licenses/LICENSE-2.0).
 '''
+import asyncio
+import atexit
+import base64
 import streamlit as st
-from pdf2image import convert_from_path
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 import os
+from collections import deque
 from datetime import datetime, timedelta
+import queue
+import threading
 import time
-import ollama
-import gc
+from backends import Backend, create_backend, RETRYABLE_ERRORS
+from page_cache import Cache
 import logging
+import logging.handlers
 import tempfile
-import shutil
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('pdf_to_markdown.log')
-    ]
+
+# Set up logging through a queue: callers pay a microsecond enqueue and a
+# background listener thread does the formatting and stream/file I/O, keeping
+# slow writes off the processing loop
+_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_console_handler = logging.StreamHandler()
+_console_handler.setFormatter(_formatter)
+_file_handler = logging.FileHandler('pdf_to_markdown.log')
+_file_handler.setFormatter(_formatter)
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, _console_handler, _file_handler)
+_log_listener.start()
+# Drain the queue before the interpreter exits; the listener thread is a
+# daemon, so without this the final records of a run can be dropped
+atexit.register(_log_listener.stop)
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# Keep the record unformatted in the queue; the listener's handlers format it
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+
+# Number of concurrent requests kept in flight against the Ollama server.
+# Match this to the server-side OLLAMA_NUM_PARALLEL setting (see README).
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "4"))
+
+# Number of page images packed into a single ollama.chat request. Batching
+# amortizes the HTTP round-trip and prompt prefill across pages; lower this
+# if the model runs out of VRAM or keeps mangling the page delimiter.
+BATCH_SIZE = int(os.getenv("PDF2MD_BATCH_SIZE", "4"))
+
+# Pages per rasterization task submitted to the process pool. Slicing PDFs
+# lets one large document use every core instead of a single pool worker.
+PAGES_PER_TASK = int(os.getenv("PDF2MD_PAGES_PER_TASK", "10"))
+
+# Delimiter the model is instructed to emit between the pages of a batch.
+PAGE_BREAK = "<<<PAGE_BREAK>>>"
+
+# Extraction prompts, built once at import. Earlier versions wrapped the text
+# in a literal 'message="..."' — the model received that wrapper as part of
+# the user content, which sometimes provoked it into echoing boilerplate.
+PROMPT = (
+    "Extract the content of this image as a markdown document. "
+    "Do not wrap in a markdown code block. "
+    "Ensure the order of content is preserved in the final output. "
+    "Tables should be returned as a markdown table."
+)
+BATCH_PROMPT = (
+    "For each image below, in order, extract the content as a markdown document. "
+    "Do not wrap in a markdown code block. "
+    "Ensure the order of content is preserved in the final output. "
+    "Tables should be returned as a markdown table. "
+    f"Separate the output for each image with a line containing only {PAGE_BREAK}."
 )
 
-def cleanup_temp_files(directory):
+# Minimum number of characters a page's text layer must contain before the
+# page is treated as born-digital and extracted directly, bypassing both the
+# rasterizer and the vision model. Set to 0 to send every page to the model.
+MIN_TEXT_CHARS = int(os.getenv("PDF2MD_MIN_TEXT_CHARS", "200"))
+
+# Rasterization DPI before the MAX_EDGE cap is applied. 150 DPI keeps text
+# readable while cutting rasterization CPU and decode memory compared to the
+# 200 DPI a typical converter defaults to.
+RASTER_DPI = int(os.getenv("PDF2MD_DPI", "150"))
+
+# Longest edge (in pixels) a page image is allowed to keep before it is sent
+# to the model. llama3.2-vision re-tiles oversized inputs server-side at a
+# fixed tile resolution, so pixels beyond ~2 tiles per edge only burn vision
+# encoder compute; default 200 DPI pages are 6-9x larger than needed.
+MAX_EDGE = int(os.getenv("PDF2MD_MAX_EDGE", "1120"))
+
+def _render_pdf(pdf_path: str, fmt: str = "jpeg", quality: int = 75, max_edge: int = MAX_EDGE, first_page: int = 1, last_page: int = None) -> list:
     """
-    Clean up temporary files and directories
+    Convert one slice of a PDF (first_page..last_page inclusive, the whole
+    document by default) into per-page payloads, in page order. Pages with a
+    usable text layer come back as the extracted text (str) and never touch
+    the rasterizer or the vision model; the remaining pages are rendered
+    in-process by MuPDF, scaled so their longest side stays within max_edge,
+    and come back as encoded image bytes. Nothing touches disk.
     """
-    try:
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-            logging.info(f"Cleaned up temporary directory: {directory}")
-    except Exception as e:
-        logging.error(f"Error cleaning up directory {directory}: {str(e)}")
+    payloads = []
+    with pymupdf.open(pdf_path) as pdf:
+        for page_index in range(first_page - 1, len(pdf) if last_page is None else last_page):
+            page = pdf[page_index]
+            # A page is born-digital when it carries a real text layer and no
+            # raster artwork; pages with embedded images still go through the
+            # vision model so figures and scanned content are not dropped.
+            text = page.get_text().strip()
+            if MIN_TEXT_CHARS and len(text) >= MIN_TEXT_CHARS and not page.get_images():
+                payloads.append(text)
+                continue
+            # Fold the max_edge cap into the render matrix: pixels beyond the
+            # cap would be thrown away anyway, so never produce them
+            scale = RASTER_DPI / 72
+            long_side = max(page.rect.width, page.rect.height) * scale
+            if max_edge and long_side > max_edge:
+                scale *= max_edge / long_side
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(scale, scale), colorspace=pymupdf.csRGB)
+            if fmt.lower() == "jpeg":
+                payloads.append(pix.tobytes("jpeg", jpg_quality=quality))
+            else:
+                payloads.append(pix.tobytes(fmt.lower()))
+    return payloads
 
-def convert_pdf_to_images(src_directory: str, tgt_directory: str = "./temp", fmt: str = "jpeg"):
+def _render_tasks(src_directory: str, pdf_files: list) -> list:
     """
-    Convert all PDFs in the source directory to images and save them in the target directory.
-    Return a list of image files.
+    Split the PDFs into (pdf_file, pdf_path, first_page, last_page) slices of
+    at most PAGES_PER_TASK pages, so one large PDF spreads across every pool
+    worker instead of pinning a single core.
     """
-    image_files = []
-    try:
-        if not os.path.exists(tgt_directory):
-            os.makedirs(tgt_directory)
-        
-        pdf_files = [file for file in os.listdir(src_directory) if file.endswith('.pdf')]
-        
-        for pdf_file in pdf_files:
-            logging.info(f"Converting PDF to images: {pdf_file}")
-            prefix = pdf_file.replace('.pdf', '')
-            images = convert_from_path(
-                os.path.join(src_directory, pdf_file), 
-                output_folder=tgt_directory, 
-                fmt=fmt, 
-                output_file=prefix,
-                paths_only=True
-            )
-            image_files.extend(images)
-            
-            # Force garbage collection after each PDF conversion
-            gc.collect()
-            
-        return image_files
-    except Exception as e:
-        logging.error(f"Error in PDF conversion: {str(e)}")
-        raise
+    tasks = []
+    for pdf_file in pdf_files:
+        pdf_path = os.path.join(src_directory, pdf_file)
+        with pymupdf.open(pdf_path) as pdf:
+            n_pages = len(pdf)
+        for first in range(1, n_pages + 1, PAGES_PER_TASK):
+            tasks.append((pdf_file, pdf_path, first, min(first + PAGES_PER_TASK - 1, n_pages)))
+    return tasks
 
-def save_output(filename: str, content: str):
+def convert_pdf_to_images(src_directory: str, page_queue: queue.Queue, fmt: str = "jpeg", quality: int = 75, max_edge: int = MAX_EDGE):
     """
-    Save content to a specified file, ensuring the directory exists.
+    Convert all PDFs in the source directory to in-memory page images,
+    pushing ((pdf_file, page_number), payload) entries onto page_queue in
+    document order as slices finish rendering, followed by a None sentinel. payload is either
+    extracted text (str, for born-digital pages) or image bytes. PDFs are
+    split into PAGES_PER_TASK-page slices dispatched across a process pool
+    (one worker per core at most), since rasterization is CPU-bound. Run this
+    in a thread so the model consumer can start on early pages while later
+    slices are still rendering; the bounded queue applies backpressure if
+    inference falls behind.
     """
-    output_directory = os.path.dirname(filename)
-    if not os.path.exists(output_directory):
-        os.makedirs(output_directory)
-    with open(filename, "a") as f:
-        f.write(content)
+    try:
+        # scandir's DirEntry answers is_file() from the directory read itself,
+        # avoiding a stat syscall per entry on big or networked directories
+        pdf_files = [
+            entry.name for entry in os.scandir(src_directory)
+            if entry.is_file() and entry.name.lower().endswith('.pdf')
+        ]
+        if not pdf_files:
+            return
+
+        # Fix the document order up front; the queue must carry pages in this
+        # order for the consumer to stream finished pages to the output file
+        pdf_files.sort()
+
+        tasks = _render_tasks(src_directory, pdf_files)
+        with ProcessPoolExecutor(max_workers=min(len(tasks), os.cpu_count())) as executor:
+            futures = [
+                (executor.submit(_render_pdf, pdf_path, fmt, quality, max_edge, first, last), pdf_file, first)
+                for pdf_file, pdf_path, first, last in tasks
+            ]
+            # Collect slices in submission order, not completion order: the
+            # pool still renders them all in parallel, and an out-of-order
+            # slice merely waits its turn to be enqueued
+            for future, pdf_file, first in futures:
+                for offset, payload in enumerate(future.result()):
+                    page_queue.put(((pdf_file, first + offset), payload))
+                logging.info(f"Converted pages of {pdf_file} from p.{first}")
+    except Exception as e:
+        logging.error(f"Error in PDF conversion: {str(e)}")
+    finally:
+        page_queue.put(None)
 
 def format_elapsed_time(seconds):
     """
@@ -105,72 +210,247 @@ def format_elapsed_time(seconds):
     tdelta = timedelta(seconds=seconds)
     return str(tdelta)
 
-def process_images_with_model(image_files: list, model: str, progress_bar, status_text, progress_text, time_text) -> str:
+def _batch_prompt(batch_size: int) -> str:
+    """
+    Pick the extraction prompt for a batch of images. A single image keeps the
+    original prompt; multiple images add the page-break delimiter instruction.
+    """
+    return BATCH_PROMPT if batch_size > 1 else PROMPT
+
+@retry(stop=stop_after_attempt(5), wait=wait_exponential(min=1, max=30),
+       retry=retry_if_exception_type(RETRYABLE_ERRORS), reraise=True)
+async def _call_model(backend: Backend, model: str, images_data: list) -> str:
+    """
+    Send one batch of page images to the model and return the raw markdown.
+    Transient failures (dropped connections, timeouts, error statuses from the
+    server, responses missing the message body) are retried up to 5 times with
+    exponential backoff, so a momentary server hiccup does not abandon a long
+    multi-hour run.
     """
-    Process each image with a multimodal model and return the combined content.
-    Memory-efficient version with proper cleanup.
+    return await backend.chat(model, _batch_prompt(len(images_data)), images_data)
+
+class OutputWriter:
     """
-    combined_content = ""
-    total_images = len(image_files)
-    
-    for index, image in enumerate(sorted(image_files)):
+    Buffered writer for the combined markdown report. Opens the file once with
+    a 1 MiB buffer (one open/close for the whole run instead of one syscall
+    per page) and fsyncs on exit, so a process killed right after a run
+    cannot lose the last OS-buffered chunk of a multi-hour extraction.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.f = open(path, "w", buffering=1 << 20)
+
+    def __enter__(self):
+        return self
+
+    def write(self, chunk: str):
+        self.f.write(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+async def process_images_with_model(page_queue: queue.Queue, total_images: int, model: str, out_fh, backend: Backend, progress_bar, status_text, progress_text, time_text, max_concurrency: int = OLLAMA_CONCURRENCY) -> int:
+    """
+    Consume ((pdf_file, page_number), payload) entries from page_queue (fed by
+    convert_pdf_to_images running in a thread) until the None sentinel, and
+    stream the markdown for each page to out_fh in page order: the queue
+    delivers pages in document order, and batches that finish out of order
+    are parked until every page before them is written, so memory holds only
+    the out-of-order window rather than the whole report. Pages whose
+    payload is already extracted text are written out directly without
+    touching the model. Images are packed
+    BATCH_SIZE to a request so the server amortizes prompt prefill across
+    pages, and up to max_concurrency batches are in flight at once. A new
+    batch is dispatched only when one of those slots frees up; when inference
+    falls behind, the consumer stops draining, the bounded queue fills, and
+    the producer blocks, so rendered pages never pile up in memory beyond
+    the in-flight window plus the queue itself. The progress
+    widgets advance as each batch finishes. All requests go through the
+    single backend passed in, so they reuse one connection pool instead of
+    re-handshaking per batch. Returns the number of pages written.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    cache = Cache()
+    cache_hits = 0
+    finished = 0
+    text_pages = 0
+    image_pages = 0
+
+    # Each unit of work — a text-layer page or a dispatched batch — gets a
+    # sequence number in queue (= document) order. Finished units are parked
+    # in `completed` and the contiguous prefix is flushed to the output file
+    # immediately, so a unit's markdown lives in memory only while an earlier
+    # unit is still in flight.
+    completed = {}
+    next_flush = 0
+    pages_written = 0
+
+    def flush_ready():
+        nonlocal next_flush, pages_written
+        while next_flush in completed:
+            for (pdf_file, page_number), content in completed.pop(next_flush):
+                if content is None:
+                    # Keep the page's slot visible in the output instead of
+                    # silently dropping it, so a failed page is easy to find
+                    # and redo
+                    out_fh.write(f"<!-- {pdf_file} p.{page_number} failed -->\n\n")
+                    continue
+                out_fh.write(content)
+                out_fh.write("\n\n")
+                pages_written += 1
+            next_flush += 1
+
+    # Every widget call is a rerun message over the Streamlit websocket, so
+    # updates are throttled to one refresh per 250 ms (the final state always
+    # renders); on a fast model per-batch updates would otherwise dominate UI
+    # latency. Wall-clock time per page over the last few batches feeds a
+    # running ETA, which is more useful mid-run than raw elapsed time.
+    page_times = deque(maxlen=16)
+    last_ui = 0.0
+    last_done = time.monotonic()
+
+    def update_widgets(batch=None, elapsed_time=0, force=False):
+        nonlocal last_ui
+        now = time.monotonic()
+        if now - last_ui < 0.25 and not force:
+            return
+        last_ui = now
+        if batch and elapsed_time:
+            status_text.write(f"Processed {', '.join(f'{pdf_file} p.{page_number}' for (pdf_file, page_number), _ in batch)} in {format_elapsed_time(elapsed_time)}")
+        if page_times and finished < total_images:
+            eta = sum(page_times) / len(page_times) * (total_images - finished)
+            time_text.write(f"Estimated time remaining: {format_elapsed_time(eta)}")
+        progress_text.write(f"Progress: {finished / total_images * 100:.2f}%")
+        progress_bar.progress(min(finished / total_images, 1.0))
+
+    async def chat_images(images_data: list):
+        # Concurrency is limited by the dispatch semaphore held around each
+        # batch (see the drain loop); the per-image fallback calls here run
+        # sequentially under their batch's slot
         try:
-            if not os.path.exists(image):
-                logging.error(f"File not found: {image}")
-                st.error(f"File not found: {image}")
-                continue
-            
-            start_time = time.time()
-            logging.info(f"Processing image {index + 1}/{total_images}: {image}")
-            
-            # Read image in a controlled block
-            with open(image, "rb") as image_file:
-                image_data = image_file.read()
-                response = ollama.chat(
-                    model=model,
-                    messages=[{
-                        'role': 'user',
-                        'content': 'message="Extract the content of this image as a markdown document. Do not wrap in a markdown code block. Ensure the order of content is preserved in the final output. Tables should be returned as a markdown table."',
-                        'images': [image_data]
-                    }]
-                )
-            
+            return await _call_model(backend, model, images_data)
+        except RETRYABLE_ERRORS as e:
+            logging.error(f"Model call failed after retries: {e}")
+            st.error(f"Model call failed after retries: {e}")
+            return None
+
+    async def process_batch(batch: list):
+        nonlocal cache_hits
+        labels = [f"{pdf_file} p.{page_number}" for (pdf_file, page_number), _ in batch]
+        start_time = time.time()
+        try:
+            logging.info(f"Processing {', '.join(labels)}")
+
+            images_data = [image_data for _, image_data in batch]
+
+            # Serve previously processed pages from the cache; only misses hit the model
+            keys = [Cache.key(image_data) for image_data in images_data]
+            pages = [cache.get(model, key) for key in keys]
+            cache_hits += sum(1 for page in pages if page is not None)
+            misses = [i for i, page in enumerate(pages) if page is None]
+
+            if misses:
+                # Encode to base64 once per page; the client passes strings
+                # through untouched, so retries and the per-image fallback
+                # reuse the same encoding instead of re-encoding the bytes
+                miss_data = [base64.b64encode(images_data[i]).decode() for i in misses]
+                content = await chat_images(miss_data)
+                if content is None:
+                    fresh = [None] * len(misses)
+                elif len(miss_data) > 1:
+                    fresh = [page.strip() for page in content.split(PAGE_BREAK)]
+                    if len(fresh) != len(miss_data):
+                        # The model did not honor the delimiter; redo this batch one image at a time
+                        logging.warning(
+                            f"Expected {len(miss_data)} pages but got {len(fresh)}; "
+                            f"retrying batch at {labels[0]} one image per request"
+                        )
+                        fresh = [await chat_images([image_data]) for image_data in miss_data]
+                else:
+                    fresh = [content]
+
+                for i, page in zip(misses, fresh):
+                    if page is not None:
+                        cache.put(model, keys[i], page)
+                    pages[i] = page
+
             # Clear the image data from memory
-            del image_data
-            
-            if isinstance(response, dict) and 'message' in response:
-                content = response['message']['content']
-                combined_content += content + "\n\n"
-                
-                # Clear response data
-                del content
-                del response
-            else:
-                logging.error(f"Unexpected response format for image {image}")
-                st.error("Unexpected response format")
-                continue
-            
+            del images_data
+
             elapsed_time = time.time() - start_time
-            formatted_elapsed_time = format_elapsed_time(elapsed_time)
-            
-            # Update UI
-            status_text.write(f"Processed {image} in {formatted_elapsed_time}")
-            progress_text.write(f"Progress: {(index + 1) / total_images * 100:.2f}%")
-            time_text.write(f"Time elapsed: {formatted_elapsed_time}")
-            progress_bar.progress((index + 1) / total_images)
-            
-            # Force garbage collection after each image
-            gc.collect()
-            
-            # Add a small delay between processing to allow system cleanup
-            time.sleep(1)
-            
+            return [(page_key, page) for (page_key, _), page in zip(batch, pages)], elapsed_time
         except Exception as e:
-            logging.error(f"Error processing image {image}: {str(e)}")
-            st.error(f"Error processing image: {str(e)}")
+            logging.error(f"Error processing batch at {labels[0]}: {str(e)}")
+            st.error(f"Error processing images: {str(e)}")
+            return [(page_key, None) for page_key, _ in batch], 0
+
+    async def run_batch(seq: int, batch: list):
+        nonlocal finished, last_done
+        try:
+            batch_results, elapsed_time = await process_batch(batch)
+        finally:
+            semaphore.release()
+        completed[seq] = batch_results
+        flush_ready()
+        finished += len(batch)
+        now = time.monotonic()
+        page_times.extend([(now - last_done) / len(batch)] * len(batch))
+        last_done = now
+
+        update_widgets(batch, elapsed_time)
+
+    # Drain the queue as the producer fills it, dispatching a batch to the
+    # model as soon as BATCH_SIZE image pages are available AND a dispatch
+    # slot is free — taking entries any faster would just park page bytes in
+    # task closures, defeating the queue bound. Born-digital pages already
+    # carry their text; only image pages see the model.
+    tasks = []
+    pending = []
+    next_seq = 0
+    while True:
+        entry = await asyncio.to_thread(page_queue.get)
+        if entry is None:
+            break
+        page_key, payload = entry
+        if isinstance(payload, str):
+            completed[next_seq] = [(page_key, payload)]
+            next_seq += 1
+            flush_ready()
+            finished += 1
+            text_pages += 1
+            update_widgets()
             continue
-    
-    return combined_content
+        pending.append(entry)
+        image_pages += 1
+        if len(pending) == BATCH_SIZE:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(run_batch(next_seq, pending)))
+            next_seq += 1
+            pending = []
+    if pending:
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(run_batch(next_seq, pending)))
+        next_seq += 1
+
+    await asyncio.gather(*tasks)
+    flush_ready()
+    update_widgets(force=True)
+
+    if total_images:
+        logging.info(f"Text-layer pages extracted without the model: {text_pages}/{total_images}")
+        if text_pages:
+            st.info(f"📝 Text-layer pages extracted without the model: {text_pages}/{total_images}")
+        if image_pages:
+            logging.info(f"Cache hits: {cache_hits}/{image_pages} ({cache_hits / image_pages:.0%})")
+            st.info(f"♻️ Cache hits: {cache_hits}/{image_pages} pages ({cache_hits / image_pages:.0%})")
+
+    return pages_written
 
 def main():
     try:
@@ -181,10 +461,6 @@ def main():
             layout="wide"
         )
 
-        # Create a unique temporary directory for this session
-        temp_dir = tempfile.mkdtemp(prefix="pdf_to_md_")
-        logging.info(f"Created temporary directory: {temp_dir}")
-
         # Header section with styling
         st.markdown("""
         <h1 style='text-align: center;'>PDF to Markdown Converter 📄</h1>
@@ -199,9 +475,15 @@ def main():
         with st.expander("⚙️ Advanced Settings"):
             col1, col2 = st.columns(2)
             with col1:
+                backend_name = st.selectbox(
+                    "Backend",
+                    ["ollama", "vllm"],
+                    index=0,
+                    help="vllm expects an OpenAI-compatible server (see README)"
+                )
                 model_name = st.selectbox(
                     "Select Model",
-                    ["llama3.2-vision:11b-instruct-q8_0", "llava", "bakllava"],
+                    ["llama3.2-vision:11b-instruct-q8_0", "llava", "bakllava", "Qwen/Qwen2.5-VL-7B-Instruct"],
                     index=0
                 )
                 image_format = st.selectbox(
@@ -211,6 +493,11 @@ def main():
                 )
             with col2:
                 image_quality = st.slider("Image Quality", 0, 100, 75)
+                max_edge = st.slider("Max Image Edge (px)", 560, 2240, MAX_EDGE)
+                max_concurrency = st.slider(
+                    "Max Concurrency", 1, 16, OLLAMA_CONCURRENCY,
+                    help="Requests kept in flight against Ollama; match the server's OLLAMA_NUM_PARALLEL"
+                )
                 output_directory = st.text_input("Output Directory", "/Users/spider/Desktop/outputmd")
 
         # Start conversion button
@@ -221,88 +508,94 @@ def main():
                     st.error("Please upload at least one PDF file.")
                     return
 
-                # Process uploaded files
-                st.info("Processing uploaded files...")
-                logging.info("Starting PDF processing")
-                pdf_paths = []
+                # Uploads and the PDFs handed to the render workers live in a
+                # scoped temporary directory that is removed however the block
+                # exits
+                with tempfile.TemporaryDirectory(prefix="pdf_to_md_") as temp_dir:
+                    # Process uploaded files
+                    st.info("Processing uploaded files...")
+                    logging.info("Starting PDF processing")
+                    pdf_paths = []
                 
-                for uploaded_file in uploaded_files:
-                    temp_path = os.path.join(temp_dir, uploaded_file.name)
-                    with open(temp_path, "wb") as f:
-                        f.write(uploaded_file.getvalue())
-                    pdf_paths.append(temp_path)
-                    logging.info(f"Saved uploaded file: {temp_path}")
-
-                # Convert PDFs to images with progress bar
-                with st.spinner("Converting PDFs to images..."):
-                    image_files = []
-                    for pdf_path in pdf_paths:
-                        try:
-                            images = convert_from_path(
-                                pdf_path,
-                                output_folder=temp_dir,
-                                fmt=image_format,
-                                output_file=os.path.splitext(os.path.basename(pdf_path))[0],
-                                paths_only=True
-                            )
-                            image_files.extend(images)
-                            gc.collect()  # Cleanup after each PDF conversion
-                        except Exception as e:
-                            logging.error(f"Error converting PDF {pdf_path}: {str(e)}")
-                            st.error(f"Error converting PDF: {str(e)}")
-
-                if not image_files:
-                    st.warning("No pages found in the uploaded PDF files.")
-                    return
+                    for uploaded_file in uploaded_files:
+                        temp_path = os.path.join(temp_dir, uploaded_file.name)
+                        with open(temp_path, "wb") as f:
+                            f.write(uploaded_file.getvalue())
+                        pdf_paths.append(temp_path)
+                        logging.info(f"Saved uploaded file: {temp_path}")
+
+                    # Count pages up front (opening the PDFs is cheap) so the progress
+                    # bar has a denominator before any page finishes rendering
+                    pdf_files = [
+                        entry.name for entry in os.scandir(temp_dir)
+                        if entry.is_file() and entry.name.lower().endswith('.pdf')
+                    ]
+                    total_images = sum(
+                        last - first + 1
+                        for _, _, first, last in _render_tasks(temp_dir, pdf_files)
+                    )
+                    if not total_images:
+                        st.warning("No pages found in the uploaded PDF files.")
+                        return
 
-                # Display number of pages to process
-                st.info(f"Found {len(image_files)} pages to process")
-                logging.info(f"Found {len(image_files)} pages to process")
+                    # Display number of pages to process
+                    st.info(f"Found {total_images} pages to process")
+                    logging.info(f"Found {total_images} pages to process")
 
-                # Process images with the model
-                progress_bar = st.progress(0)
-                status_text = st.empty()
+                    # Start rasterizing in the background so inference can begin
+                    # on early pages while later slices are still rendering.
+                    # Buffer a few batches of rendered pages ahead of inference
+                    # while still bounding memory.
+                    page_queue = queue.Queue(maxsize=4 * BATCH_SIZE)
+                    producer = threading.Thread(
+                        target=convert_pdf_to_images,
+                        args=(temp_dir, page_queue, image_format),
+                        kwargs={"quality": image_quality, "max_edge": max_edge},
+                        daemon=True
+                    )
+                    producer.start()
+
+                    # Process images with the model
+                    progress_bar = st.progress(0)
+                    status_text = st.empty()
                 
-                # Create two columns for progress tracking
-                prog_col1, prog_col2 = st.columns(2)
-                with prog_col1:
-                    progress_text = st.empty()
-                with prog_col2:
-                    time_text = st.empty()
-
-                # Process images and get combined content
-                combined_content = process_images_with_model(
-                    image_files, model_name, progress_bar,
-                    status_text, progress_text, time_text
-                )
+                    # Create two columns for progress tracking
+                    prog_col1, prog_col2 = st.columns(2)
+                    with prog_col1:
+                        progress_text = st.empty()
+                    with prog_col2:
+                        time_text = st.empty()
 
-                if combined_content:
-                    # Save output
+                    # Process images, streaming the extracted content to the output file
                     datetime_str = datetime.now().strftime("%Y%m%d_%H%M%S")
                     output_filename = os.path.join(output_directory, f"combined_output_{datetime_str}.md")
-                    save_output(output_filename, combined_content)
-                    
-                    st.success(f"✅ Conversion completed! Output saved to: {output_filename}")
-                    logging.info(f"Conversion completed. Output saved to: {output_filename}")
+
+                    backend = create_backend(backend_name)
+                    with OutputWriter(output_filename) as out_fh:
+                        pages_written = asyncio.run(process_images_with_model(
+                            page_queue, total_images, model_name, out_fh, backend,
+                            progress_bar, status_text, progress_text, time_text,
+                            max_concurrency=max_concurrency
+                        ))
+                    producer.join()
+
+                    if pages_written:
+                        st.success(f"✅ Conversion completed! Output saved to: {output_filename}")
+                        logging.info(f"Conversion completed. Output saved to: {output_filename}")
                     
-                    # Offer download button
-                    with open(output_filename, "r") as f:
-                        st.download_button(
-                            label="📥 Download Markdown File",
-                            data=f.read(),
-                            file_name=f"converted_pdf_{datetime_str}.md",
-                            mime="text/markdown"
-                        )
+                        # Offer download button
+                        with open(output_filename, "r") as f:
+                            st.download_button(
+                                label="📥 Download Markdown File",
+                                data=f.read(),
+                                file_name=f"converted_pdf_{datetime_str}.md",
+                                mime="text/markdown"
+                            )
                 
             except Exception as e:
                 logging.error(f"Error in conversion process: {str(e)}")
                 st.error(f"An error occurred during conversion: {str(e)}")
-            
-            finally:
-                # Cleanup temporary files
-                cleanup_temp_files(temp_dir)
-                gc.collect()
-                
+
     except Exception as e:
         logging.error(f"Error in main application: {str(e)}")
         st.error(f"An error occurred in the application: {str(e)}")